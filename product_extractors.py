@@ -0,0 +1,109 @@
+import json
+import math
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+
+# Collects the contents of <script type="application/ld+json"> blocks
+class JSONLDParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.blocks = []
+        self.in_json_ld = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "script" and dict(attrs).get("type", "").lower() == "application/ld+json":
+            self.in_json_ld = True
+            self.blocks.append("")
+
+    def handle_endtag(self, tag):
+        if tag == "script":
+            self.in_json_ld = False
+
+    def handle_data(self, data):
+        if self.in_json_ld:
+            self.blocks[-1] += data
+
+
+# Walk JSON-LD data (single objects, lists and @graph containers) and yield schema.org Product items
+def iter_json_ld_products(data):
+    if isinstance(data, list):
+        for item in data:
+            yield from iter_json_ld_products(item)
+    elif isinstance(data, dict):
+        item_type = data.get("@type")
+        item_types = item_type if isinstance(item_type, list) else [item_type]
+        if "Product" in item_types:
+            yield data
+        if "@graph" in data:
+            yield from iter_json_ld_products(data["@graph"])
+
+
+# Parse a JSON-LD price; returns None for missing or non-finite values like "nan"
+def parse_price(value):
+    try:
+        price = float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+    return price if math.isfinite(price) else None
+
+
+# Convert a schema.org Product into the product dict used by the rest of the app.
+# Returns None when the product has no EUR price.
+def json_ld_to_product(item, url):
+    offers = item.get("offers") or {}
+    offer = offers[0] if isinstance(offers, list) and offers else offers
+    if not isinstance(offer, dict):
+        return None
+
+    currency = offer.get("priceCurrency")
+    price = parse_price(offer.get("price", offer.get("lowPrice")))
+    if price is None or (currency and not (isinstance(currency, str) and currency.upper() == "EUR")):
+        return None
+
+    website = urlparse(url).netloc.removeprefix("www.")
+    seller = offer.get("seller")
+    brand = item.get("brand")
+
+    properties = {}
+    if isinstance(brand, dict) and brand.get("name"):
+        properties["Brand"] = brand["name"]
+    elif isinstance(brand, str) and brand:
+        properties["Brand"] = brand
+    additional_properties = item.get("additionalProperty") or []
+    if isinstance(additional_properties, dict):
+        additional_properties = [additional_properties]
+    for prop in additional_properties:
+        name = prop.get("name") if isinstance(prop, dict) else None
+        if isinstance(name, str) and name and prop.get("value") is not None:
+            properties[name] = str(prop["value"])
+
+    return {
+        "provider": seller.get("name", website) if isinstance(seller, dict) else website,
+        "provider_website": website,
+        "provider_url": offer.get("url") or item.get("url") or url,
+        "product_name": item.get("name", "Unknown Product"),
+        "product_properties": properties,
+        "product_sku": item.get("sku") or item.get("mpn") or item.get("gtin13"),
+        "product_price": price,
+        "evaluation": "Read from the page's structured product data; not evaluated against the technical specification."
+    }
+
+
+# Extract products from a page's schema.org JSON-LD markup.
+# Returns an empty list when the page has no usable product data.
+def extract_products(html, url):
+    parser = JSONLDParser()
+    parser.feed(html)
+
+    products = []
+    for block in parser.blocks:
+        try:
+            data = json.loads(block)
+        except json.JSONDecodeError:
+            continue
+        for item in iter_json_ld_products(data):
+            product = json_ld_to_product(item, url)
+            if product:
+                products.append(product)
+    return products
@@ -2,8 +2,20 @@ import streamlit as st
 import requests
 import json
 import time
-from openai import OpenAI
+import asyncio
+import hashlib
+import ipaddress
+import threading
+import uuid
+from urllib.parse import urljoin, urlparse
+import diskcache
+import httpx
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
 from pydantic import BaseModel
+from tenacity import retry, stop_after_attempt, wait_random_exponential, retry_if_exception_type
+from product_extractors import extract_products
+from ui_render import display_results, format_price_per, products_table
 
 # Page configuration
 st.set_page_config(
@@ -37,6 +49,229 @@ if 'openai_api_key' not in st.secrets.get("config", {}):
 # Get the API key from secrets
 OPENAI_API_KEY = st.secrets["config"]["openai_api_key"]
 
+
+# Shared event loop running in a background thread. The async OpenAI client's
+# connection pool is bound to the loop it was first used on, so every async
+# request goes through this one loop instead of a fresh asyncio.run() per rerun.
+@st.cache_resource
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+# Connection pool limits shared by the sync and async OpenAI clients
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+
+
+# OpenAI client reused across reruns so connections are kept alive
+@st.cache_resource
+def get_openai_client(api_key):
+    return OpenAI(api_key=api_key, max_retries=0, http_client=DefaultHttpxClient(limits=HTTP_POOL_LIMITS))
+
+
+# Async OpenAI client reused across reruns so connections are kept alive
+@st.cache_resource
+def get_async_openai_client(api_key):
+    return AsyncOpenAI(api_key=api_key, max_retries=0, http_client=DefaultAsyncHttpxClient(limits=HTTP_POOL_LIMITS))
+
+
+# Number of URLs analyzed per OpenAI request
+BATCH_SIZE = 4
+
+
+# Persistent on-disk cache of API results, shared by all sessions so
+# repeated searches skip the API round-trip entirely
+URL_CACHE_TTL = 24 * 3600
+PRODUCT_CACHE_TTL = 4 * 3600
+
+
+@st.cache_resource
+def get_result_cache():
+    return diskcache.Cache(".cache")
+
+
+# Search history entries live on disk; session state only keeps their ids,
+# capped to the most recent MAX_HISTORY searches
+MAX_HISTORY = 50
+HISTORY_TTL = 7 * 24 * 3600
+
+
+@st.cache_resource
+def get_history_store():
+    return diskcache.Cache(".history")
+
+
+def make_cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+# Count cache hits/misses for the current session
+def record_cache_lookup(hit):
+    counter = "cache_hits" if hit else "cache_misses"
+    st.session_state[counter] = st.session_state.get(counter, 0) + 1
+
+
+# Retry transient OpenAI failures (rate limits, network errors, 5xx) with
+# exponential backoff and jitter. Wraps only the API call itself. The clients
+# are created with max_retries=0 so this is the only retry layer.
+retry_openai_request = retry(
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)),
+    reraise=True,
+)
+
+
+# Shared async HTTP client for fetching product pages directly. Like the
+# async OpenAI client it is only used from the shared event loop. Redirects
+# are followed manually so every hop can be checked with resolve_public_address.
+PAGE_FETCH_TIMEOUT = 5
+MAX_PAGE_REDIRECTS = 5
+# PAGE_FETCH_TIMEOUT applies per connect/read, so each page fetch, including
+# DNS lookups and redirects, is also bounded as a whole
+PAGE_FETCH_DEADLINE = 10
+# Only the first MAX_PAGE_BYTES of a page are read; JSON-LD normally sits in
+# the <head>, so this keeps huge pages from being buffered whole
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+
+
+@st.cache_resource
+def get_async_http_client():
+    return httpx.AsyncClient(
+        limits=HTTP_POOL_LIMITS,
+        timeout=PAGE_FETCH_TIMEOUT,
+        follow_redirects=False,
+        headers={"User-Agent": "Mozilla/5.0 (compatible; ProductPriceSearcher/1.0)"}
+    )
+
+
+# Only http(s) URLs whose host resolves to public addresses may be fetched, so
+# user-supplied URLs cannot reach localhost, cloud metadata or private networks.
+# Returns the address to connect to, or None. Pages are requested from this
+# address directly, so a second DNS lookup cannot swap in a private one.
+async def resolve_public_address(url):
+    try:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            return None
+        addresses = await asyncio.get_running_loop().getaddrinfo(
+            parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80))
+        for *_, sockaddr in addresses:
+            address = ipaddress.ip_address(sockaddr[0])
+            if address.version == 6 and address.ipv4_mapped:
+                address = address.ipv4_mapped
+            if not address.is_global:
+                return None
+    except (OSError, ValueError):
+        return None
+    return addresses[0][4][0] if addresses else None
+
+
+# Leaky-bucket limiter that keeps async requests under a requests-per-minute budget.
+# The budget is passed on each acquire so the current sidebar setting applies.
+# The bucket starts with a single request so a fresh limiter cannot burst.
+# Only used from the shared event loop, so no extra locking is needed.
+class RequestRateLimiter:
+    def __init__(self):
+        self.available_requests = 1
+        self.last_update = time.monotonic()
+
+    async def acquire(self, max_requests_per_minute):
+        while True:
+            now = time.monotonic()
+            refill = (now - self.last_update) * max_requests_per_minute / 60
+            self.available_requests = min(max_requests_per_minute, self.available_requests + refill)
+            self.last_update = now
+
+            if self.available_requests >= 1:
+                self.available_requests -= 1
+                return
+
+            # Sleep until the next request slot frees up
+            await asyncio.sleep((1 - self.available_requests) * 60 / max_requests_per_minute)
+
+
+# Rate limiter shared by all sessions, since the RPM budget is per API key
+@st.cache_resource
+def get_rate_limiter():
+    return RequestRateLimiter()
+
+
+# State of one price analysis running in the background. The worker thread
+# writes to it and the polling UI reads from it, so updates go through a lock.
+class AnalysisJob:
+    def __init__(self, category, product_name, tech_spec, price_calc_objective, urls):
+        self.category = category
+        self.product_name = product_name
+        self.tech_spec = tech_spec
+        self.price_calc_objective = price_calc_objective
+        self.urls = urls
+        self.lock = threading.Lock()
+        self.products = []
+        self.log = []
+        self.errors = []
+        self.completed = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cancelled = False
+        self.finished = False
+        self.request_futures = []
+        self.future = None
+
+    def add_products(self, url, products, source=""):
+        with self.lock:
+            self.products.extend(products)
+            self.log.append(f"{url}: {len(products)} products{source}")
+
+    def add_error(self, message):
+        with self.lock:
+            self.errors.append(message)
+            self.log.append(message)
+
+    def advance(self, count=1):
+        with self.lock:
+            self.completed += count
+
+    # Register in-flight request futures so cancel() can stop them
+    def track(self, futures):
+        with self.lock:
+            self.request_futures.extend(futures)
+            if self.cancelled:
+                for future in futures:
+                    future.cancel()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            for future in self.request_futures:
+                future.cancel()
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.products), list(self.log), self.completed
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+
+# Worker threads for background analyses, shared by all sessions
+@st.cache_resource
+def get_analysis_executor():
+    return ThreadPoolExecutor(max_workers=4)
+
+
+# Request throttling settings
+st.sidebar.header("Request Settings")
+MAX_CONCURRENT = st.sidebar.slider("Concurrent requests", 1, 20, 8)
+MAX_REQUESTS_PER_MINUTE = st.sidebar.number_input("Max requests per minute", min_value=1, value=100)
+DIRECT_PAGE_EXTRACTION = st.sidebar.checkbox(
+    "Read prices from page data when available",
+    value=True,
+    help="Skips the OpenAI request for pages that publish structured product data. "
+         "These products are not evaluated against the technical specification."
+)
+
 # Create tabs for different sections
 tab1, tab2, tab3 = st.tabs(["Product Search", "Search History", "About"])
 
@@ -93,9 +328,15 @@ with tab1:
             )
 
 
-    # Function to discover URLs for a product based on category and specification
-    def discover_product_urls(category, product_name, tech_spec, api_key):
-        client = OpenAI(api_key=api_key)
+    # Structured output schema for URL discovery
+    class URLs(BaseModel):
+        urls: list[str]
+
+
+    # Function to query OpenAI for product URLs. Results are memoized by the
+    # disk cache in discover_product_urls, which also skips empty results.
+    def request_product_urls(category, product_name, tech_spec, api_key):
+        client = get_openai_client(api_key)
 
         prompt_initial = f"""
         You need to get information regarding webpages presenting actual product prices. 
@@ -113,31 +354,38 @@ with tab1:
          Check every URL to get product price
         """
 
-        try:
-            class URLs(BaseModel):
-                urls: list[str]
-
-            response = client.responses.parse(
-                model="gpt-4.1",
-                tools=[{
-                    "type": "web_search_preview",
-                    "user_location": {
-                        "type": "approximate",
-                        "country": "LT",
-                        "city": "Vilnius",
-                    }
-                }],
-                temperature=0.2,
-                input=prompt_initial,
-                text_format=URLs,
-            )
-
-            urls = response.output_parsed.urls
-            return urls
+        response = retry_openai_request(client.responses.parse)(
+            model="gpt-4.1",
+            tools=[{
+                "type": "web_search_preview",
+                "user_location": {
+                    "type": "approximate",
+                    "country": "LT",
+                    "city": "Vilnius",
+                }
+            }],
+            temperature=0.2,
+            input=prompt_initial,
+            text_format=URLs,
+        )
+
+        return response.output_parsed.urls
+
+
+    # Function to discover URLs for a product based on category and specification,
+    # served from the disk cache when possible
+    def discover_product_urls(category, product_name, tech_spec, api_key):
+        cache = get_result_cache()
+        cache_key = make_cache_key("urls", category, product_name, tech_spec)
+        cached_urls = cache.get(cache_key)
+        record_cache_lookup(cached_urls is not None)
+        if cached_urls is not None:
+            return cached_urls
 
-        except Exception as e:
-            st.error(f"Error discovering URLs: {str(e)}")
-            return []
+        urls = request_product_urls(category, product_name, tech_spec, api_key)
+        if urls:
+            cache.set(cache_key, urls, expire=URL_CACHE_TTL)
+        return urls
 
 
     # Step 1: URL Discovery Phase Button
@@ -147,386 +395,475 @@ with tab1:
             st.stop()
 
         with st.spinner(f"Discovering relevant URLs for {product_name} in {product_category} category..."):
-            discovered_urls = discover_product_urls(product_category, product_name, tech_spec, OPENAI_API_KEY)
+            try:
+                discovered_urls = discover_product_urls(product_category, product_name, tech_spec, OPENAI_API_KEY)
+            except Exception as e:
+                st.error(f"Error discovering URLs: {str(e)}")
+                discovered_urls = []
 
+            # Map each URL to whether it is included in the analysis, in discovery order
             if discovered_urls:
-                st.session_state.discovered_urls = discovered_urls
+                st.session_state.url_entries = dict.fromkeys(discovered_urls, True)
                 st.success(f"Found {len(discovered_urls)} relevant URLs for {product_name}")
             else:
                 st.warning("Could not discover any relevant URLs. Try modifying your search criteria.")
-                st.session_state.discovered_urls = []
+                st.session_state.url_entries = {}
 
-    # Display discovered URLs and allow user to manage them
-    if "discovered_urls" in st.session_state and st.session_state.discovered_urls:
+    # Discovered URL review, run as a fragment so toggling a checkbox or adding
+    # a URL only reruns this block instead of the whole script
+    @st.fragment
+    def url_management_ui():
         st.subheader("Discovered URLs")
         st.write("Review and manage the discovered URLs before proceeding with price analysis:")
 
-        urls_to_remove = []
+        # Input for adding new URL. Handled before the list is drawn, so a new
+        # URL shows up in this same run without an explicit rerun.
+        new_url = st.text_input("Add new URL:", placeholder="Enter a URL (e.g., https://example.lt/product)")
+        if st.button("Add URL") and new_url:
+            if new_url not in st.session_state.url_entries:
+                st.session_state.url_entries[new_url] = True
+                st.success(f"Added {new_url} to the list")
+            else:
+                st.info(f"{new_url} is already in the list")
 
-        for i, url in enumerate(st.session_state.discovered_urls):
+        url_entries = st.session_state.url_entries
+        for i, (url, included) in enumerate(url_entries.items()):
             col1, col2 = st.columns([4, 1])
             with col1:
                 st.write(f"{i + 1}. [{url}]({url})")
             with col2:
-                if st.checkbox("Include", value=True, key=f"url_{i}"):
-                    pass  # Keep URL if checked
-                else:
-                    urls_to_remove.append(url)
-
-        # Remove unchecked URLs
-        for url in urls_to_remove:
-            if url in st.session_state.discovered_urls:
-                st.session_state.discovered_urls.remove(url)
+                # Unchecking only flips the flag, so the list and its keys stay stable
+                url_entries[url] = st.checkbox("Include", value=included, key=f"include_{url}")
 
-        # Input for adding new URL
-        new_url = st.text_input("Add new URL:", placeholder="Enter a URL (e.g., https://example.lt/product)")
-        if st.button("Add URL") and new_url:
-            if new_url not in st.session_state.discovered_urls:
-                st.session_state.discovered_urls.append(new_url)
-                st.success(f"Added {new_url} to the list")
-                st.experimental_rerun()
-            else:
-                st.info(f"{new_url} is already in the list")
+    # Display discovered URLs and allow user to manage them
+    if st.session_state.get("url_entries"):
+        url_management_ui()
 
 
-    # Function to analyze product prices from a specific URL
-    def analyze_product_prices(category, product_name, tech_spec, url, price_calc_objective, api_key):
-        client = OpenAI(api_key=api_key)
+    # Function to download a page for structured data extraction. Returns the
+    # html and the final url after redirects, or None when the page cannot be
+    # fetched, so the URL falls through to LLM analysis. Parsing is left to the
+    # worker thread to keep the shared event loop free.
+    async def fetch_page_async(url, http_client):
+        page_url = url
+        try:
+            for _ in range(MAX_PAGE_REDIRECTS + 1):
+                address = await resolve_public_address(page_url)
+                if address is None:
+                    return None
+
+                # Connect to the checked address. The Host header and TLS server
+                # name keep the original host, so virtual hosts and certificate
+                # checks work as usual. Connections are pooled per address.
+                parsed = urlparse(page_url)
+                host = f"[{address}]" if ":" in address else address
+                port = parsed.port or (443 if parsed.scheme == "https" else 80)
+                pinned_url = parsed._replace(netloc=f"{host}:{port}").geturl()
+                async with http_client.stream(
+                    "GET",
+                    pinned_url,
+                    headers={"Host": parsed.netloc.rpartition("@")[2]},
+                    extensions={"sni_hostname": parsed.hostname}
+                ) as response:
+                    if response.has_redirect_location:
+                        page_url = urljoin(page_url, response.headers["Location"])
+                        continue
+                    response.raise_for_status()
+
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body += chunk
+                        if len(body) >= MAX_PAGE_BYTES:
+                            break
+                    encoding = response.charset_encoding or "utf-8"
+                    break
+            else:
+                return None
+        except httpx.HTTPError:
+            return None
 
+        try:
+            return body[:MAX_PAGE_BYTES].decode(encoding, errors="replace"), page_url
+        except LookupError:
+            # Unknown charset in the Content-Type header
+            return body[:MAX_PAGE_BYTES].decode("utf-8", errors="replace"), page_url
+
+
+    # Structured output schema for price analysis. Properties are a list of
+    # name/value pairs because strict JSON schemas cannot have free-form keys.
+    class ProductProperty(BaseModel):
+        name: str
+        value: str
+
+
+    class Product(BaseModel):
+        provider: str
+        provider_website: str
+        provider_url: str
+        product_name: str
+        product_properties: list[ProductProperty]
+        product_sku: str | None
+        product_price: float | None
+        price_per_objective: float | None
+        evaluation: str
+
+
+    class URLProducts(BaseModel):
+        url: str
+        products: list[Product]
+
+
+    class BatchProducts(BaseModel):
+        results: list[URLProducts]
+
+
+    # Function to analyze product prices from a batch of URLs in one request.
+    # Runs on the shared event loop, so it must not call Streamlit directly:
+    # it returns the parsed model response and lets API errors propagate.
+    async def analyze_product_prices_async(category, product_name, tech_spec, urls, price_calc_objective, client,
+                                           semaphore, rate_limiter, max_requests_per_minute):
+        url_list = "\n".join(f"- {url}" for url in urls)
+        if price_calc_objective == "none":
+            price_per_instruction = "always null"
+        else:
+            price_per_instruction = f"{price_calculation_options[price_calc_objective]} in EUR, or null if unknown"
         prompt = f"""get prices for the following product:
                      category: {category}
                      product name: {product_name}
                      product specification: {tech_spec}
-                     from url = {url}
-
-            """
-        # JSON format instructions
-        prompt += """
-        IMPORTANT: Your response MUST be formatted EXACTLY as a valid JSON array of product objects.
-        Each product in the array should have the following fields:
-
-        [
-          {
-            "provider": "Company selling the product",
-            "provider_website": "Main website domain (e.g., telia.lt)",
-            "provider_url": "Full URL to the specific product page",
-            "product_name": "Complete product name with model",
-            "product_properties": {
-              "key_spec1": "value1",
-              "key_spec2": "value2"
-            },
-            "product_sku": "Any product identifiers (SKU, UPC, model number)",
-            "product_price": 299.99,
-            "price_per_unit": 9.99,
-            "evaluation": "Detailed assessment of how the product meets or fails each technical specification"
-          }
-        ]
-
-        DO NOT include any explanation, preamble, or additional text - ONLY provide the JSON array.
+                     from EACH of the following urls:
+{url_list}
+
+        Return one result per url above, using the url exactly as given.
+        For each product found on that url provide:
+        - provider: company selling the product
+        - provider_website: main website domain (e.g., telia.lt)
+        - provider_url: full URL to the specific product page
+        - product_name: complete product name with model
+        - product_properties: key specifications as name/value pairs
+        - product_sku: any product identifiers (SKU, UPC, model number)
+        - product_price: price in EUR
+        - price_per_objective: {price_per_instruction}
+        - evaluation: detailed assessment of how the product meets or fails each technical specification
         """
 
-        try:
-            completion = client.chat.completions.create(
-                model="gpt-4o-search-preview",
-                web_search_options={},
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
+        # Every attempt, including retries, counts against the per-minute budget
+        @retry_openai_request
+        async def create_response():
+            await rate_limiter.acquire(max_requests_per_minute)
+            return await client.responses.parse(
+                model="gpt-4.1",
+                tools=[{
+                    "type": "web_search_preview",
+                    "user_location": {
+                        "type": "approximate",
+                        "country": "LT",
+                        "city": "Vilnius",
                     }
-                ],
+                }],
+                input=prompt,
+                text_format=BatchProducts,
             )
 
-            response_text = completion.choices[0].message.content
-
-            # Process the response
-            try:
-                # Try to parse JSON from response
-                import re
-                json_match = re.search(r'(\[\s*{.*}\s*\]|\{\s*"products"\s*:\s*\[.*\]\s*\})', response_text, re.DOTALL)
-
-                if json_match:
-                    json_str = json_match.group(0)
-                    products_data = json.loads(json_str)
-                else:
-                    products_data = json.loads(response_text)
-
-                # Check if the response is a list or contains a 'products' key
-                if isinstance(products_data, dict) and "products" in products_data:
-                    products = products_data["products"]
-                else:
-                    products = products_data
-
-                if isinstance(products, list):
-                    return products
-                else:
-                    return []
-            except Exception as e:
-                st.warning(f"Could not parse products from URL: {str(e)}")
-                return []
-
-        except Exception as e:
-            st.error(f"API request failed: {str(e)}")
-            return []
-
-
-    # Function to display the results
-    def display_results(all_products, category, product_name, price_calc_objective):
-        if not all_products:
-            st.error("No products found or error occurred during analysis.")
-            return
-
-        # Display the products
-        st.subheader(f"Found {len(all_products)} Products for {product_name} in {category} category")
-
-        # Display results in expandable sections
-        for i, product in enumerate(all_products):
-            product_title = f"{i + 1}. {product.get('product_name', 'Unknown Product')} - €{product.get('product_price', 'N/A')}"
-
-            # Add price calculation to title if available
-            if price_calc_objective != "none":
-                price_per_key = f"price_per_{price_calc_objective}"
-                if price_per_key in product:
-                    unit_display = ""
-                    if price_calc_objective == "unit" and "unit_type" in product:
-                        unit_display = f"/{product['unit_type']}"
-                    elif price_calc_objective == "kg":
-                        unit_display = "/kg"
-                    elif price_calc_objective == "liter":
-                        unit_display = "/L"
-                    elif price_calc_objective == "package":
-                        unit_display = "/pkg"
-
-                    product_title += f" (€{product.get(price_per_key, 'N/A')}{unit_display})"
-
-            with st.expander(product_title):
-                col1, col2 = st.columns([1, 2])
-
-                with col1:
-                    st.markdown(f"**Provider:** {product.get('provider', 'N/A')}")
-                    st.markdown(f"**Website:** {product.get('provider_website', 'N/A')}")
-                    if 'provider_url' in product and product['provider_url']:
-                        st.markdown(f"**Product Link:** [View Product]({product['provider_url']})")
-                    st.markdown(f"**SKU/ID:** {product.get('product_sku', 'N/A')}")
-                    st.markdown(f"**Price:** €{product.get('product_price', 'N/A')}")
-
-                    # Display price calculation if available
-                    if price_calc_objective != "none":
-                        price_per_key = f"price_per_{price_calc_objective}"
-                        if price_per_key in product:
-                            unit_display = ""
-                            if price_calc_objective == "unit" and "unit_type" in product:
-                                unit_display = f"/{product['unit_type']}"
-                            elif price_calc_objective == "kg":
-                                unit_display = "/kg"
-                            elif price_calc_objective == "liter":
-                                unit_display = "/L"
-                            elif price_calc_objective == "package":
-                                unit_display = "/pkg"
-
-                            st.markdown(
-                                f"**Price per {price_calc_objective.capitalize()}:** €{product.get(price_per_key, 'N/A')}{unit_display}")
-
-                with col2:
-                    st.subheader("Product Properties")
-                    properties = product.get('product_properties', {})
-                    if properties:
-                        for key, value in properties.items():
-                            st.markdown(f"**{key}:** {value}")
+        # Cap in-flight requests
+        async with semaphore:
+            response = await create_response()
+
+        return response.output_parsed
+
+
+    # Function to convert a parsed batch response into plain product dicts per URL.
+    # Products listed under a url that does not match a requested URL are
+    # returned under that url so they are still shown. The calculated price is
+    # stored as price_per_<objective>, the key the result views read.
+    def parse_products(batch_products, urls, price_calc_objective):
+        if batch_products is None:
+            return {}
+
+        products_by_url = {}
+        normalized_urls = {url.rstrip("/"): url for url in urls}
+        for result in batch_products.results:
+            url = normalized_urls.get(result.url.rstrip("/"), result.url)
+            for product in result.products:
+                product_data = product.model_dump()
+                price_per_objective = product_data.pop("price_per_objective")
+                if price_calc_objective != "none" and price_per_objective is not None:
+                    product_data[f"price_per_{price_calc_objective}"] = price_per_objective
+                product_data["product_properties"] = {
+                    prop.name: prop.value for prop in product.product_properties
+                }
+                products_by_url.setdefault(url, []).append(product_data)
+        return products_by_url
+
+
+    # Function to run a price analysis in a worker thread. It must not call
+    # Streamlit; progress and results are reported through the job, and all
+    # shared resources are resolved by the caller in the script thread.
+    def run_analysis(job, cache, loop, openai_client, http_client, rate_limiter, max_requests_per_minute,
+                     max_concurrent, direct_page_extraction):
+        # Serve previously analyzed URLs from the result cache
+        cache_keys = {
+            url: make_cache_key("products", job.category, job.product_name, job.tech_spec, url,
+                                job.price_calc_objective)
+            for url in job.urls
+        }
+        pending_urls = []
+        for url in job.urls:
+            cached_products = cache.get(cache_keys[url])
+            if cached_products is not None:
+                job.cache_hits += 1
+                job.add_products(url, cached_products, " (cached)")
+                job.advance()
+            else:
+                job.cache_misses += 1
+                pending_urls.append(url)
+
+        semaphore = asyncio.Semaphore(max_concurrent)
+        llm_futures = {}
+
+        # Send one batch of URLs to the LLM on the shared event loop
+        def submit_batch(batch):
+            future = asyncio.run_coroutine_threadsafe(
+                analyze_product_prices_async(
+                    job.category,
+                    job.product_name,
+                    job.tech_spec,
+                    batch,
+                    job.price_calc_objective,
+                    openai_client,
+                    semaphore,
+                    rate_limiter,
+                    max_requests_per_minute
+                ),
+                loop
+            )
+            llm_futures[future] = batch
+            job.track([future])
+            return future
+
+        # Read products directly from pages that publish structured data,
+        # fetching all pages concurrently; the rest go to the LLM. Page data is
+        # not evaluated against the spec, so it is not stored in the result
+        # cache, which only holds LLM analyses.
+        page_futures = {}
+        if direct_page_extraction:
+            page_futures = {
+                asyncio.run_coroutine_threadsafe(
+                    asyncio.wait_for(fetch_page_async(url, http_client), PAGE_FETCH_DEADLINE), loop
+                ): url
+                for url in pending_urls
+            }
+            job.track(page_futures)
+            llm_urls = []
+        else:
+            llm_urls = pending_urls
+
+        # Collect page and LLM results in completion order. URLs without page
+        # data are batched for the LLM as they come in, so batch requests do
+        # not wait for the slowest page.
+        outstanding = set(page_futures)
+        pages_left = len(page_futures)
+        while True:
+            while len(llm_urls) >= BATCH_SIZE or (llm_urls and not pages_left):
+                outstanding.add(submit_batch(llm_urls[:BATCH_SIZE]))
+                llm_urls = llm_urls[BATCH_SIZE:]
+            if not outstanding:
+                break
+
+            done, outstanding = wait(outstanding, return_when=FIRST_COMPLETED)
+            if job.cancelled:
+                return
+
+            for future in done:
+                if future in page_futures:
+                    pages_left -= 1
+                    url = page_futures[future]
+                    try:
+                        page = future.result()
+                        products = extract_products(*page) if page else []
+                    except Exception:
+                        # Unreadable or timed out pages fall through to the LLM
+                        # like pages without data
+                        products = []
+                    if products:
+                        job.add_products(url, products, " (from page data)")
+                        job.advance()
                     else:
-                        st.write("No detailed properties available.")
+                        llm_urls.append(url)
+                    continue
+
+                batch = llm_futures[future]
+                try:
+                    products_by_url = parse_products(future.result(), batch, job.price_calc_objective)
+                except Exception as e:
+                    job.add_error(f"API request failed: {str(e)}")
+                    products_by_url = {}
+
+                for url, products in products_by_url.items():
+                    if products and url in cache_keys:
+                        cache.set(cache_keys[url], products, expire=PRODUCT_CACHE_TTL)
+                    job.add_products(url, products)
+                job.advance(len(batch))
+
+
+    # Live progress of the running analysis. Run as a polling fragment; once the
+    # job is done it reruns the full script to show the final results.
+    def analysis_progress_ui():
+        job = st.session_state.analysis_job
+        if job.done():
+            st.rerun()
+
+        # Each tick redraws the status and a single table of the products found
+        # so far; the detailed result views are rendered once the job is done
+        products, log, completed = job.snapshot()
+        with st.status(f"Analyzing prices for {job.product_name}: {completed}/{len(job.urls)} URLs done, "
+                       f"{len(products)} products found so far...", expanded=True):
+            if log:
+                st.markdown("\n\n".join(log))
+        st.progress(completed / len(job.urls))
+        if products:
+            st.dataframe(
+                products_table(products, job.price_calc_objective),
+                use_container_width=True,
+                hide_index=True,
+                column_config={"URL": st.column_config.LinkColumn()},
+            )
 
-                    st.subheader("Technical Evaluation")
-                    evaluation = product.get('evaluation', 'No evaluation available.')
-                    st.write(evaluation)
+        if st.button("Cancel analysis"):
+            job.cancel()
 
-        # Show raw JSON option
-        with st.expander("View Raw JSON Response"):
-            st.json(all_products)
 
+    # Function to record a finished analysis in this session: cache counters
+    # and search history. Runs once per job, in the script thread.
+    def finish_analysis(job):
+        job.finished = True
+        st.session_state.cache_hits = st.session_state.get("cache_hits", 0) + job.cache_hits
+        st.session_state.cache_misses = st.session_state.get("cache_misses", 0) + job.cache_misses
 
-    # Step 2: Product Price Analysis Button
-    if "discovered_urls" in st.session_state and st.session_state.discovered_urls:
-        if st.button("Analyze Product Prices", type="primary"):
-            with st.spinner(
-                    f"Analyzing prices for {product_name} from {len(st.session_state.discovered_urls)} URLs..."):
-                all_products = []
-
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-
-                active_urls = [url for i, url in enumerate(st.session_state.discovered_urls)
-                               if st.session_state.get(f"url_{i}", True)]
-
-                if not active_urls:
-                    st.warning("No URLs selected. Please select at least one URL.")
-                    st.stop()
-
-                for i, url in enumerate(active_urls):
-                    status_text.text(f"Analyzing URL {i + 1}/{len(active_urls)}: {url}")
-
-                    products = analyze_product_prices(
-                        product_category,
-                        product_name,
-                        tech_spec,
-                        url,
-                        price_calc_objective,
-                        OPENAI_API_KEY
-                    )
+        if job.future.exception() is not None:
+            job.errors.append(f"Analysis failed: {str(job.future.exception())}")
 
-                    if products:
-                        all_products.extend(products)
-
-                    # Update progress
-                    progress_value = (i + 1) / len(active_urls)
-                    progress_bar.progress(progress_value)
-
-                status_text.text("Analysis complete!")
-
-                if all_products:
-                    # Save to session state for history
-                    if "search_history" not in st.session_state:
-                        st.session_state.search_history = []
-
-                    history_entry = {
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "category": product_category,
-                        "product_name": product_name,
-                        "tech_spec": tech_spec,
-                        "price_calc_objective": price_calc_objective,
-                        "results": all_products
-                    }
-                    st.session_state.search_history.append(history_entry)
-
-                    # Display the results
-                    display_results(all_products, product_category, product_name, price_calc_objective)
-                else:
-                    st.error("No products found matching your specifications.")
-
-
-    # Function to display the results
-    def display_results(all_products, category, product_name, price_calc_objective):
-        if not all_products:
-            st.error("No products found or error occurred during analysis.")
-            return
-
-        # Display the products
-        st.subheader(f"Found {len(all_products)} Products for {product_name} in {category} category")
-
-        # Display results in expandable sections
-        for i, product in enumerate(all_products):
-            product_title = f"{i + 1}. {product.get('product_name', 'Unknown Product')} - €{product.get('product_price', 'N/A')}"
-
-            # Add price calculation to title if available
-            if price_calc_objective != "none":
-                price_per_key = f"price_per_{price_calc_objective}"
-                if price_per_key in product:
-                    unit_display = ""
-                    if price_calc_objective == "unit" and "unit_type" in product:
-                        unit_display = f"/{product['unit_type']}"
-                    elif price_calc_objective == "kg":
-                        unit_display = "/kg"
-                    elif price_calc_objective == "liter":
-                        unit_display = "/L"
-                    elif price_calc_objective == "package":
-                        unit_display = "/pkg"
-
-                    product_title += f" (€{product.get(price_per_key, 'N/A')}{unit_display})"
-
-            with st.expander(product_title):
-                col1, col2 = st.columns([1, 2])
-
-                with col1:
-                    st.markdown(f"**Provider:** {product.get('provider', 'N/A')}")
-                    st.markdown(f"**Website:** {product.get('provider_website', 'N/A')}")
-                    if 'provider_url' in product and product['provider_url']:
-                        st.markdown(f"**Product Link:** [View Product]({product['provider_url']})")
-                    st.markdown(f"**SKU/ID:** {product.get('product_sku', 'N/A')}")
-                    st.markdown(f"**Price:** €{product.get('product_price', 'N/A')}")
-
-                    # Display price calculation if available
-                    if price_calc_objective != "none":
-                        price_per_key = f"price_per_{price_calc_objective}"
-                        if price_per_key in product:
-                            unit_display = ""
-                            if price_calc_objective == "unit" and "unit_type" in product:
-                                unit_display = f"/{product['unit_type']}"
-                            elif price_calc_objective == "kg":
-                                unit_display = "/kg"
-                            elif price_calc_objective == "liter":
-                                unit_display = "/L"
-                            elif price_calc_objective == "package":
-                                unit_display = "/pkg"
-
-                            st.markdown(
-                                f"**Price per {price_calc_objective.capitalize()}:** €{product.get(price_per_key, 'N/A')}{unit_display}")
-
-                with col2:
-                    st.subheader("Product Properties")
-                    properties = product.get('product_properties', {})
-                    if properties:
-                        for key, value in properties.items():
-                            st.markdown(f"**{key}:** {value}")
-                    else:
-                        st.write("No detailed properties available.")
+        if job.products:
+            # Save to the history store, keeping only the entry id in session state
+            if "search_history" not in st.session_state:
+                st.session_state.search_history = []
 
-                    st.subheader("Technical Evaluation")
-                    evaluation = product.get('evaluation', 'No evaluation available.')
-                    st.write(evaluation)
+            history_entry = {
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "category": job.category,
+                "product_name": job.product_name,
+                "tech_spec": job.tech_spec,
+                "price_calc_objective": job.price_calc_objective,
+                "results": job.products
+            }
+            history_store = get_history_store()
+            history_id = uuid.uuid4().hex
+            history_store.set(history_id, history_entry, expire=HISTORY_TTL)
+            st.session_state.search_history.append(history_id)
 
-        # Show raw JSON option
-        with st.expander("View Raw JSON Response"):
-            st.json(all_products)
+            # Drop entries beyond the cap from disk as well
+            for old_history_id in st.session_state.search_history[:-MAX_HISTORY]:
+                history_store.delete(old_history_id)
+            st.session_state.search_history = st.session_state.search_history[-MAX_HISTORY:]
+
+
+    # Step 2: Product Price Analysis Button
+    analysis_job = st.session_state.get("analysis_job")
+    analysis_running = analysis_job is not None and not analysis_job.done()
+
+    if st.session_state.get("url_entries"):
+        if st.button("Analyze Product Prices", type="primary", disabled=analysis_running):
+            active_urls = [url for url, included in st.session_state.url_entries.items() if included]
+
+            if not active_urls:
+                st.warning("No URLs selected. Please select at least one URL.")
+                st.stop()
+
+            # Run the analysis in the background so the page stays responsive
+            analysis_job = AnalysisJob(product_category, product_name, tech_spec, price_calc_objective, active_urls)
+            analysis_job.future = get_analysis_executor().submit(
+                run_analysis,
+                analysis_job,
+                get_result_cache(),
+                get_event_loop(),
+                get_async_openai_client(OPENAI_API_KEY),
+                get_async_http_client(),
+                get_rate_limiter(),
+                MAX_REQUESTS_PER_MINUTE,
+                MAX_CONCURRENT,
+                DIRECT_PAGE_EXTRACTION
+            )
+            st.session_state.analysis_job = analysis_job
+            analysis_running = True
+
+    # Show the running analysis, or the results of the last one
+    if analysis_running:
+        st.fragment(analysis_progress_ui, run_every=0.5)()
+    elif analysis_job is not None:
+        if not analysis_job.finished:
+            finish_analysis(analysis_job)
+
+        for error in analysis_job.errors:
+            st.error(error)
+        if analysis_job.cancelled:
+            st.warning("Analysis cancelled. Showing the results received so far.")
+
+        if analysis_job.products:
+            display_results(analysis_job.products, analysis_job.category, analysis_job.product_name,
+                            analysis_job.price_calc_objective)
+        else:
+            st.error("No products found matching your specifications.")
 
 with tab2:
     st.header("Search History")
 
-    if "search_history" not in st.session_state or not st.session_state.search_history:
+    # st.tabs draws every tab on each rerun, so entries are only read from disk
+    # while the history view is switched on
+    if not st.session_state.get("search_history"):
         st.info("No search history yet. Search for products to see your history here.")
-    else:
-        for i, entry in enumerate(reversed(st.session_state.search_history)):
-            # Add category and product name to history entry title
-            category_info = f"[{entry.get('category', 'Unknown')}]"
-            product_info = f"{entry.get('product_name', 'Unknown Product')}"
-            price_calc_info = ""
-            if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                price_calc_info = f" (Price per {entry['price_calc_objective']})"
-
-            with st.expander(f"{entry['timestamp']} - {category_info} {product_info} {price_calc_info}"):
-                st.markdown(f"**Category:** {entry.get('category', 'None')}")
-                st.markdown(f"**Product:** {entry.get('product_name', 'None')}")
-                st.markdown(f"**Search Query:**\n{entry['tech_spec']}")
-
-                # Show price calculation objective if available
-                if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                    st.markdown(f"**Price Calculation:** Price per {entry['price_calc_objective']}")
+    elif st.toggle(f"Show {len(st.session_state.search_history)} saved searches", key="show_search_history"):
+        # Load this session's entries from disk, skipping any that have expired
+        history_store = get_history_store()
+        search_history = [
+            entry for entry in (history_store.get(history_id) for history_id in st.session_state.search_history)
+            if entry is not None
+        ]
 
-                st.markdown(f"**Results:** {len(entry['results'])} products found")
+        if not search_history:
+            st.info("No search history yet. Search for products to see your history here.")
+        else:
+            for i, entry in enumerate(reversed(search_history)):
+                # Add category and product name to history entry title
+                category_info = f"[{entry.get('category', 'Unknown')}]"
+                product_info = f"{entry.get('product_name', 'Unknown Product')}"
+                price_calc_info = ""
+                if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
+                    price_calc_info = f" (Price per {entry['price_calc_objective']})"
 
-                # Display results again
-                for j, product in enumerate(entry['results']):
-                    # Basic product info
-                    product_info = f"**{j + 1}. {product.get('product_name', 'Unknown Product')}** - €{product.get('product_price', 'N/A')}"
+                with st.expander(f"{entry['timestamp']} - {category_info} {product_info} {price_calc_info}"):
+                    st.markdown(f"**Category:** {entry.get('category', 'None')}")
+                    st.markdown(f"**Product:** {entry.get('product_name', 'None')}")
+                    st.markdown(f"**Search Query:**\n{entry['tech_spec']}")
 
-                    # Add price calculation if available
+                    # Show price calculation objective if available
                     if "price_calc_objective" in entry and entry["price_calc_objective"] != "none":
-                        price_per_key = f"price_per_{entry['price_calc_objective']}"
-                        if price_per_key in product:
-                            unit_display = ""
-                            if entry["price_calc_objective"] == "unit" and "unit_type" in product:
-                                unit_display = f"/{product['unit_type']}"
-                            elif entry["price_calc_objective"] == "kg":
-                                unit_display = "/kg"
-                            elif entry["price_calc_objective"] == "liter":
-                                unit_display = "/L"
-                            elif entry["price_calc_objective"] == "package":
-                                unit_display = "/pkg"
-
-                            product_info += f" (€{product.get(price_per_key, 'N/A')}{unit_display})"
-
-                    st.markdown(product_info)
-                    st.markdown(
-                        f"Provider: {product.get('provider', 'N/A')} | [View Product]({product.get('provider_url', '#')})")
+                        st.markdown(f"**Price Calculation:** Price per {entry['price_calc_objective']}")
+
+                    st.markdown(f"**Results:** {len(entry['results'])} products found")
+
+                    # Display results again
+                    for j, product in enumerate(entry['results']):
+                        # Basic product info
+                        product_info = f"**{j + 1}. {product.get('product_name', 'Unknown Product')}** - €{product.get('product_price', 'N/A')}"
+
+                        # Add price calculation if available
+                        price_per = format_price_per(product, entry.get("price_calc_objective", "none"))
+                        if price_per:
+                            product_info += f" ({price_per})"
+
+                        st.markdown(
+                            f"{product_info}\n\n"
+                            f"Provider: {product.get('provider', 'N/A')} | [View Product]({product.get('provider_url', '#')})")
 
 with tab3:
     st.header("About This Application")
@@ -566,11 +903,12 @@ with tab3:
 
     This application uses:
     - Streamlit for the web interface
-    - OpenAI API with GPT-4o Search for intelligent market research
+    - OpenAI API with GPT-4.1 web search and structured outputs for intelligent market research
     - Two-step search approach:
       1. First discovers relevant product URLs
-      2. Then analyzes each URL for detailed product information
+      2. Then analyzes the selected URLs in concurrent, batched requests for detailed product information
     - JSON for structured data handling
+    - Direct reading of schema.org product data from pages that publish it, skipping the OpenAI request
     - Customizable URL selection for targeted searches
     - Specialized price calculations for better product comparison
 
@@ -581,6 +919,12 @@ with tab3:
     necessary for the application to function.
     """)
 
+# Cache statistics, rendered last so they include lookups from this run
+st.sidebar.header("Cache")
+cache_col1, cache_col2 = st.sidebar.columns(2)
+cache_col1.metric("Hits", st.session_state.get("cache_hits", 0))
+cache_col2.metric("Misses", st.session_state.get("cache_misses", 0))
+
 # Footer
 st.markdown("---")
 st.markdown("© 2025 Lithuanian Market Product Analyzer | Powered by OpenAI API")
\ No newline at end of file
@@ -0,0 +1,121 @@
+import streamlit as st
+import pandas as pd
+
+
+# Unit suffix shown after a calculated price, per price calculation objective
+UNIT_DISPLAY = {
+    "unit": "",
+    "kg": "/kg",
+    "liter": "/L",
+    "package": "/pkg"
+}
+
+
+# Format a product's calculated price (e.g. "€1.99/kg"), or "" if unavailable
+def format_price_per(product, price_calc_objective):
+    if price_calc_objective == "none":
+        return ""
+
+    price_per_key = f"price_per_{price_calc_objective}"
+    if product.get(price_per_key) is None:
+        return ""
+
+    if price_calc_objective == "unit" and "unit_type" in product:
+        unit_display = f"/{product['unit_type']}"
+    else:
+        unit_display = UNIT_DISPLAY.get(price_calc_objective, "")
+    return f"€{product[price_per_key]}{unit_display}"
+
+
+# Function to render products as expandable sections, numbered from start_index
+def render_products(products, price_calc_objective, start_index=1):
+    for i, product in enumerate(products, start=start_index):
+        product_title = f"{i}. {product.get('product_name', 'Unknown Product')} - €{product.get('product_price', 'N/A')}"
+
+        # Add price calculation to title if available
+        price_per = format_price_per(product, price_calc_objective)
+        if price_per:
+            product_title += f" ({price_per})"
+
+        with st.expander(product_title):
+            col1, col2 = st.columns([1, 2])
+
+            # Product details are sent as one markdown block instead of one element per line
+            with col1:
+                lines = [
+                    f"**Provider:** {product.get('provider', 'N/A')}",
+                    f"**Website:** {product.get('provider_website', 'N/A')}",
+                ]
+                if 'provider_url' in product and product['provider_url']:
+                    lines.append(f"**Product Link:** [View Product]({product['provider_url']})")
+                lines.append(f"**SKU/ID:** {product.get('product_sku', 'N/A')}")
+                lines.append(f"**Price:** €{product.get('product_price', 'N/A')}")
+
+                # Display price calculation if available
+                if price_per:
+                    lines.append(f"**Price per {price_calc_objective.capitalize()}:** {price_per}")
+
+                st.markdown("\n\n".join(lines))
+
+            with col2:
+                st.subheader("Product Properties")
+                properties = product.get('product_properties', {})
+                if properties:
+                    st.markdown("\n\n".join(f"**{key}:** {value}" for key, value in properties.items()))
+                else:
+                    st.write("No detailed properties available.")
+
+                st.subheader("Technical Evaluation")
+                evaluation = product.get('evaluation', 'No evaluation available.')
+                st.write(evaluation)
+
+
+# Function to build the results table, one row per product
+def products_table(products, price_calc_objective):
+    rows = []
+    for product in products:
+        row = {
+            "Provider": product.get("provider"),
+            "Product": product.get("product_name"),
+            "Price €": product.get("product_price"),
+        }
+        if price_calc_objective != "none":
+            row[f"Price per {price_calc_objective.capitalize()} €"] = product.get(f"price_per_{price_calc_objective}")
+        row["URL"] = product.get("provider_url")
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+# Function to display the results, as a fragment so interacting with the
+# results does not rerun the surrounding script
+@st.fragment
+def display_results(all_products, category, product_name, price_calc_objective):
+    if not all_products:
+        st.error("No products found or error occurred during analysis.")
+        return
+
+    # Display the products
+    st.subheader(f"Found {len(all_products)} Products for {product_name} in {category} category")
+
+    # Display results in a single table; the virtualized grid only mounts visible rows
+    selection = st.dataframe(
+        products_table(all_products, price_calc_objective),
+        use_container_width=True,
+        hide_index=True,
+        column_config={"URL": st.column_config.LinkColumn()},
+        on_select="rerun",
+        selection_mode="multi-row",
+        key="results_table",
+    )
+
+    # Show expandable details only for the rows the user selected
+    selected_rows = selection.selection.rows
+    if selected_rows:
+        for i in sorted(selected_rows):
+            render_products([all_products[i]], price_calc_objective, start_index=i + 1)
+    else:
+        st.caption("Select rows in the table to see product details.")
+
+    # Show raw JSON option
+    with st.expander("View Raw JSON Response"):
+        st.json(all_products)